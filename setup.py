@@ -8,7 +8,13 @@ setup(
     author="Daniel Schick",
     author_email="schick@mbi-berlin.de",
     python_requires=">=3.6",
-    entry_points={"console_scripts": ["PhyMotion = tangods_phymotion:main"]},
+    entry_points={
+        "console_scripts": [
+            "PhyMotion = tangods_phymotion:main",
+            "PhyMotionReplay = tangods_phymotion.replay:main",
+            "PhyMotionLoadTest = tangods_phymotion.loadtest:main",
+        ]
+    },
     license="MIT",
     packages=["tangods_phymotion"],
     install_requires=[
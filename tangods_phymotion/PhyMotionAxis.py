@@ -2,10 +2,11 @@
 # coding: utf8
 # PhyMotionAxis
 
-from tango import Database, DevFailed, AttrWriteType, DevState
+from tango import Database, DevFailed, AttrWriteType, DevState, AttrQuality
 from tango import DeviceProxy, DispLevel
 from tango.server import device_property
 from tango.server import Device, attribute, command
+import math
 import time
 
 
@@ -57,6 +58,24 @@ class PhyMotionAxis(Device):
         ),
     )
 
+    EncoderMonitor = device_property(
+        dtype="bool",
+        default_value=False,
+        doc=(
+            "Read the encoder counter (P22) together with the status\n"
+            "query and compute the following error against P20."
+        ),
+    )
+
+    FollowingErrorLimit = device_property(
+        dtype="float",
+        default_value=0,
+        doc=(
+            "Alarm threshold for the absolute following error\n"
+            "in movement units (0 disables the alarm)."
+        ),
+    )
+
     # device attributes
     sw_limit_minus = attribute(
         dtype="float",
@@ -85,6 +104,20 @@ class PhyMotionAxis(Device):
         display_level=DispLevel.OPERATOR,
     )
 
+    following_error = attribute(
+        dtype="float",
+        format="%8.3f",
+        label="following error",
+        unit="steps",
+        access=AttrWriteType.READ,
+        display_level=DispLevel.EXPERT,
+        doc=(
+            "Motor position (P20) minus encoder position (P22 * P39).\n"
+            "Only valid if the EncoderMonitor property is set,\n"
+            "otherwise the quality is INVALID."
+        ),
+    )
+
     last_position = attribute(
         dtype="float",
         format="%8.3f",
@@ -289,6 +322,12 @@ class PhyMotionAxis(Device):
         self._last_status_query = 0
         self._statusbits = 25 * [0]
         self._inverted = False
+        self._following_error = 0.0
+
+        # status query, extended by the encoder counter if monitored
+        self._status_cmd = ["SE", "P20R"]
+        if self.EncoderMonitor:
+            self._status_cmd.append("P22R")
 
         # read all parameters
         self.read_all_parameters()
@@ -297,6 +336,11 @@ class PhyMotionAxis(Device):
             unit=_MOVEMENT_UNITS[int(self._all_parameters["P02R"]) - 1],
             steps_per_unit=1 / float(self._all_parameters["P03R"]),
         )
+        if self.FollowingErrorLimit > 0:
+            ac3 = self.get_attribute_config_3("following_error")
+            ac3[0].att_alarm.min_alarm = str(-self.FollowingErrorLimit)
+            ac3[0].att_alarm.max_alarm = str(self.FollowingErrorLimit)
+            self.set_attribute_config_3(ac3)
 
         self.set_state(DevState.ON)
 
@@ -329,13 +373,19 @@ class PhyMotionAxis(Device):
         # -> limit max. query rate to 5 Hz
         now = time.time()
         if now - self._last_status_query > self.TimeOut:
-            status, position = self.send_cmd(["SE", "P20R"])
+            ret = self.send_cmd(self._status_cmd)
+            status, position = ret[0], ret[1]
             self.debug_stream(f"position: {position}")
             self._last_status_query = now
             self._statusbits = self._decode_status(int(status), 7)
             self.debug_stream(f"status bits: {self._statusbits}")
             # set current position
             self._all_parameters["P20R"] = position
+            if self.EncoderMonitor:
+                self._all_parameters["P22R"] = ret[2]
+                self._following_error = (
+                    float(position) - float(ret[2]) * self._encoder_scale
+                )
 
             status_list = []
             for n, bit_value in enumerate(self._statusbits):
@@ -401,6 +451,15 @@ class PhyMotionAxis(Device):
             return ret
 
     def write_position(self, value):
+        if not math.isfinite(value):
+            raise ValueError(f"Invalid target position: {value}")
+        if self._limit_window is not None:
+            limit_minus, limit_plus = self._limit_window
+            if not limit_minus <= value <= limit_plus:
+                raise ValueError(
+                    f"Target position {value} outside of software limits "
+                    f"[{limit_minus}, {limit_plus}]"
+                )
         memorize_value = value
         if self._inverted:
             value = -1 * value
@@ -411,6 +470,15 @@ class PhyMotionAxis(Device):
                 "last_position", memorize_value
             )
 
+    def read_following_error(self):
+        if not self.EncoderMonitor:
+            # no encoder readout -> do not pretend a valid zero error
+            return 0.0, time.time(), AttrQuality.ATTR_INVALID
+        if self._inverted:
+            return -1 * self._following_error
+        else:
+            return self._following_error
+
     def read_last_position(self):
         return self._last_position
 
@@ -422,6 +490,7 @@ class PhyMotionAxis(Device):
 
     def write_inverted(self, value):
         self._inverted = bool(value)
+        self._update_limit_window()
 
     def read_acceleration(self):
         return int(self._all_parameters["P15R"]) * float(self._all_parameters["P03R"])
@@ -527,6 +596,7 @@ class PhyMotionAxis(Device):
     def set_display_unit(self, unit="", steps_per_unit=0):
         attributes = [
             "position",
+            "following_error",
             "last_position",
             "sw_limit_minus",
             "sw_limit_plus",
@@ -555,6 +625,25 @@ class PhyMotionAxis(Device):
                 ac3[0].format = "%8.3f"
             self.set_attribute_config_3(ac3)
 
+    def _update_limit_window(self):
+        """Precompute the allowed target window in user coordinates.
+
+        Software limits P23 (+) and P24 (-) are only monitored for
+        movement types 2 and 3 (P01), otherwise no window is applied.
+        """
+        parameters = getattr(self, "_all_parameters", {})
+        if not all(par in parameters for par in ("P01R", "P23R", "P24R")):
+            # parameters not loaded (yet), e.g. failed init_device
+            self._limit_window = None
+        elif int(parameters["P01R"]) in (2, 3):
+            limit_minus = float(parameters["P24R"])
+            limit_plus = float(parameters["P23R"])
+            if self._inverted:
+                limit_minus, limit_plus = -limit_plus, -limit_minus
+            self._limit_window = (limit_minus, limit_plus)
+        else:
+            self._limit_window = None
+
     def _send_cmd(self, cmd_str):
         # add module address to beginning of command
         if isinstance(cmd_str, list):
@@ -649,15 +738,19 @@ class PhyMotionAxis(Device):
         # parse response
         for i, cmd_str in enumerate(cmd_list):
             self._all_parameters[cmd_str] = ret[i]
+        if self.EncoderMonitor:
+            # encoder conversion factor (units per encoder increment)
+            self._encoder_scale = float(self._all_parameters["P39R"])
+        self._update_limit_window()
 
     @command(dtype_out=str)
     def dump_all_parameters(self):
         self.read_all_parameters()
-        res = ""
+        lines = []
         for par in range(1, 59):
             cmd = "P{:02d}R".format(par)
-            res = res + "P{:02d}: {:s}\n".format(par, str(self._all_parameters[cmd]))
-        return res
+            lines.append("P{:02d}: {:s}\n".format(par, str(self._all_parameters[cmd])))
+        return "".join(lines)
 
 
 if __name__ == "__main__":
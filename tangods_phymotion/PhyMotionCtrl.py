@@ -4,7 +4,13 @@
 
 from tango import DevState
 from tango.server import Device, command, device_property
+import json
 import socket
+import time
+
+
+# parameters P01 to P58 of a module
+_PARAMETERS = ["P{:02d}".format(par) for par in range(1, 59)]
 
 
 class PhyMotionCtrl(Device):
@@ -19,6 +25,42 @@ class PhyMotionCtrl(Device):
         default_value=22222,
     )
 
+    CaptureFile = device_property(
+        dtype="str",
+        default_value="",
+        doc=(
+            "Optional path of a capture file. If set, every frame sent to\n"
+            "and received from the controller is appended with a monotonic\n"
+            "timestamp. The file is line buffered, so every frame is\n"
+            "written out immediately and survives a crash of the server.\n"
+            "Use tangods_phymotion.replay to serve it back."
+        ),
+    )
+
+    Modules = device_property(
+        dtype=("int16",),
+        default_value=[1],
+        doc="Module numbers included in dump_controller.",
+    )
+
+    MaxCommandsPerFrame = device_property(
+        dtype="int",
+        default_value=58,
+        doc=(
+            "Maximum number of commands combined in a single frame\n"
+            "by dump_controller."
+        ),
+    )
+
+    PipelineWindow = device_property(
+        dtype="int",
+        default_value=1,
+        doc=(
+            "Maximum number of frames outstanding on the socket\n"
+            "in write_read_many (1 = no pipelining)."
+        ),
+    )
+
     # definition some constants
     __STX = chr(2)  # Start of text
     __ACK = chr(6)  # Command ok
@@ -30,6 +72,16 @@ class PhyMotionCtrl(Device):
         self.set_state(DevState.INIT)
         self.info_stream("init_device()")
 
+        self._rx_buffer = b""
+        self._reference = {}
+        self._capture = None
+        if self.CaptureFile:
+            try:
+                self._capture = open(self.CaptureFile, "a", buffering=1)
+                self.info_stream("Capturing frames to {:s}".format(self.CaptureFile))
+            except OSError:
+                self.error_stream("Failed to open {:s}".format(self.CaptureFile))
+
         # open socket connection
         self.con = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         try:
@@ -44,6 +96,9 @@ class PhyMotionCtrl(Device):
 
     def delete_device(self):
         self.con.close()
+        if self._capture is not None:
+            self._capture.close()
+            self._capture = None
         self.set_state(DevState.OFF)
 
     @command(dtype_in=str, dtype_out=str, fisallowed="is_write_read_allowed")
@@ -54,10 +109,51 @@ class PhyMotionCtrl(Device):
         then the command follows
         :XX is the flag to skip the checksum-verify
         """
-        cmd = self.__STX + "0" + cmd + ":XX" + self.__ETX
-        self.debug_stream("write command: {:s}".format(cmd))
-        self.con.send(cmd.encode("utf-8"))
-        res = self.con.recv(1024).decode("utf-8")
+        self._send_frame(self._build_frame(cmd))
+        return self._parse_reply(self._read_frame())
+
+    @command(
+        dtype_in=[str],
+        dtype_out=[str],
+        fisallowed="is_write_read_allowed",
+        doc_in="list of commands (see write_read)",
+        doc_out="list of responses in the order of the commands",
+    )
+    def write_read_many(self, cmds):
+        """
+        send the commands pipelined, keeping up to PipelineWindow
+        frames outstanding on the socket; replies are matched in order
+        """
+        frames = [self._build_frame(cmd) for cmd in cmds]
+        window = max(1, self.PipelineWindow)
+        replies = []
+        sent = 0
+        try:
+            while len(replies) < len(frames):
+                while sent < len(frames) and sent - len(replies) < window:
+                    self._send_frame(frames[sent])
+                    sent += 1
+                replies.append(self._parse_reply(self._read_frame()))
+        except Exception:
+            if sent > len(replies):
+                # replies still in flight would be matched to later
+                # commands -> drop the stream until re-initialisation
+                self._rx_buffer = b""
+                self.set_state(DevState.FAULT)
+                self.error_stream(
+                    "write_read_many failed with {:d} frames outstanding "
+                    "-> Fault State".format(sent - len(replies))
+                )
+            raise
+        return replies
+
+    def _build_frame(self, cmd):
+        frame = self.__STX + "0" + cmd + ":XX" + self.__ETX
+        self.debug_stream("write command: {:s}".format(frame))
+        return frame.encode("utf-8")
+
+    def _parse_reply(self, frame):
+        res = frame.decode("utf-8")
         self.debug_stream("read response: {:s}".format(res))
         if self.__ACK in res:
             return (
@@ -70,10 +166,124 @@ class PhyMotionCtrl(Device):
             # no acknowledgment in response
             return self.__NACK
 
+    def _send_frame(self, frame):
+        self.con.sendall(frame)
+        if self._capture is not None:
+            self._capture_frame(">", frame)
+
+    def _read_frame(self):
+        """Read from the socket until a complete frame (ending with ETX)
+        is available and return it. Surplus bytes are kept for the next call.
+        """
+        etx = self.__ETX.encode("utf-8")
+        while etx not in self._rx_buffer:
+            chunk = self.con.recv(1024)
+            if not chunk:
+                raise ConnectionError("connection closed by controller")
+            self._rx_buffer += chunk
+        end = self._rx_buffer.index(etx) + 1
+        frame, self._rx_buffer = self._rx_buffer[:end], self._rx_buffer[end:]
+        if self._capture is not None:
+            self._capture_frame("<", frame)
+        return frame
+
+    def _capture_frame(self, direction, frame):
+        # one line per frame: monotonic timestamp, direction, hex payload
+        try:
+            self._capture.write(
+                "{:.6f} {:s} {:s}\n".format(time.monotonic(), direction, frame.hex())
+            )
+        except OSError:
+            # never let the capture break the command/reply stream
+            self.error_stream("Failed to write capture -> capture disabled")
+            try:
+                self._capture.close()
+            except OSError:
+                pass
+            self._capture = None
+
     @command
     def dump_to_eprom(self):
         self.write_read("SA")
 
+    @command(
+        dtype_out=str,
+        fisallowed="is_write_read_allowed",
+        doc_out="JSON object {module: {parameter: value}}",
+    )
+    def dump_controller(self):
+        return json.dumps(self._read_controller_parameters())
+
+    @command(fisallowed="is_write_read_allowed")
+    def store_reference(self):
+        """store the current parameters of all modules as reference snapshot"""
+        self._reference = self._read_controller_parameters()
+
+    @command(
+        dtype_in=str,
+        dtype_out=str,
+        fisallowed="is_write_read_allowed",
+        doc_in=(
+            "reference as JSON (e.g. earlier dump_controller output),\n"
+            "empty to use the snapshot taken by store_reference"
+        ),
+        doc_out=(
+            "JSON object {module: {parameter: [reference, current]}},\n"
+            "null marks parameters missing on either side"
+        ),
+    )
+    def diff_to_reference(self, reference):
+        if reference:
+            reference = json.loads(reference)
+        elif self._reference:
+            reference = self._reference
+        else:
+            raise ValueError("no reference given and store_reference not called")
+        current = self._read_controller_parameters()
+        diff = {}
+        for module in list(current) + [m for m in reference if m not in current]:
+            ref_parameters = reference.get(module, {})
+            cur_parameters = current.get(module, {})
+            changed = {}
+            for par in list(cur_parameters) + [
+                p for p in ref_parameters if p not in cur_parameters
+            ]:
+                ref_value = ref_parameters.get(par)
+                cur_value = cur_parameters.get(par)
+                if ref_value != cur_value:
+                    changed[par] = [ref_value, cur_value]
+            if changed:
+                diff[module] = changed
+        return json.dumps(diff)
+
+    def _read_controller_parameters(self):
+        """Read the parameter tables of all configured modules.
+
+        The queries of all modules are packed into as few frames as
+        MaxCommandsPerFrame allows.
+        """
+        queries = [(module, par) for module in self.Modules for par in _PARAMETERS]
+        values = []
+        n = max(1, self.MaxCommandsPerFrame)
+        for i in range(0, len(queries), n):
+            chunk = queries[i : i + n]
+            cmd = " ".join("{:d}.1{:s}R".format(module, par) for module, par in chunk)
+            res = self.write_read(cmd)
+            if res == self.__NACK:
+                raise RuntimeError("command not acknowledged from controller")
+            fields = res.split(self.__ACK)
+            if len(fields) != len(chunk):
+                raise RuntimeError(
+                    "controller returned {:d} values for {:d} queries".format(
+                        len(fields), len(chunk)
+                    )
+                )
+            values.extend(fields)
+        result = {str(module): {} for module in self.Modules}
+        for (module, par), value in zip(queries, values):
+            result[str(module)][par] = value
+        return result
+
     def is_write_read_allowed(self):
         is_allowed = self.get_state() not in [DevState.FAULT, DevState.OFF]
         self.debug_stream(f"is_write_read_allowed(): {is_allowed}")
@@ -0,0 +1,369 @@
+#!/usr/bin/python3 -u
+# coding: utf8
+# load test of PhyMotionAxis devices against a simulated phyMotion controller
+
+import argparse
+import asyncio
+import multiprocessing
+import random
+import socket
+import socketserver
+import threading
+import time
+
+import tango
+import tango.asyncio
+from tango.test_context import MultiDeviceTestContext
+
+from .PhyMotionAxis import PhyMotionAxis
+from .PhyMotionCtrl import PhyMotionCtrl
+
+
+_STX = b"\x02"
+_ACK = "\x06"
+_NACK = "\x15"
+_ETX = b"\x03"
+
+# status bits: initialised (3), power stage ready (9), in position (19)
+_STATUS_IDLE = (1 << 3) | (1 << 9) | (1 << 19)
+
+_DEFAULT_PARAMETERS = {
+    "P01": "3",  # linear, hw + sw limits
+    "P02": "1",  # steps
+    "P03": "1",  # spindle pitch
+    "P08": "2000",  # homing velocity
+    "P14": "4000",  # velocity
+    "P15": "40000",  # acceleration
+    "P20": "0",  # position
+    "P22": "0",  # encoder counter
+    "P23": "100000",  # sw limit +
+    "P24": "-100000",  # sw limit -
+    "P25": "0",  # backlash
+    "P27": "0",  # limit switch type
+    "P39": "1",  # encoder conversion factor
+    "P40": "20",  # hold current
+    "P41": "60",  # run current
+    "P45": "0",  # step resolution
+}
+
+# client request mixes as (weight, kind, name, argument)
+MIXES = {
+    "gui": [
+        (10, "read", "position", None),
+        (10, "read", "State", None),
+        (5, "read", "Status", None),
+        (1, "read", "velocity", None),
+    ],
+    "archiver": [
+        (1, "read", "position", None),
+        (1, "read", "State", None),
+    ],
+    "scan": [
+        (5, "read", "position", None),
+        (5, "read", "State", None),
+        (1, "write", "velocity", 4000.0),
+        (1, "command", "stop", None),
+    ],
+}
+MIXES["mixed"] = MIXES["gui"] + MIXES["archiver"] + MIXES["scan"]
+
+
+class SimulatedControllerHandler(socketserver.BaseRequestHandler):
+    """Answer phyMotion frames from the in-memory axis parameters."""
+
+    def handle(self):
+        buffer = b""
+        while True:
+            chunk = self.request.recv(4096)
+            if not chunk:
+                return
+            buffer += chunk
+            while _ETX in buffer:
+                end = buffer.index(_ETX) + 1
+                frame, buffer = buffer[:end], buffer[end:]
+                self.request.sendall(self.server.process_frame(frame))
+
+
+class SimulatedController(socketserver.ThreadingTCPServer):
+    """Minimal phyMotion TCP interface with command counters.
+
+    Moves complete instantly; only the commands used by PhyMotionAxis
+    are emulated.
+    """
+
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, address, n_axes):
+        super().__init__(address, SimulatedControllerHandler)
+        self.axes = {
+            axis: dict(_DEFAULT_PARAMETERS) for axis in range(1, n_axes + 1)
+        }
+        self._lock = threading.Lock()
+        self.reset_counters()
+
+    def reset_counters(self):
+        with self._lock:
+            self.n_frames = 0
+            self.n_commands = 0
+
+    def process_frame(self, frame):
+        # STX, address "0", commands separated by spaces, ":XX", ETX
+        body = frame.decode("utf-8").strip("\x02\x03")[1:].split(":")[0]
+        cmds = body.split()
+        with self._lock:
+            self.n_frames += 1
+            self.n_commands += len(cmds)
+            try:
+                values = [self._execute(cmd) for cmd in cmds]
+            except (KeyError, ValueError):
+                return _STX + _NACK.encode("utf-8") + _ETX
+        return _STX + (_ACK + _ACK.join(values)).encode("utf-8") + _ETX
+
+    def _execute(self, cmd):
+        if "." not in cmd:
+            # controller command, e.g. SA
+            return ""
+        module, cmd = cmd.split(".", 1)
+        parameters = self.axes[int(module)]
+        cmd = cmd[1:]  # strip axis number of module
+        if cmd == "SE":
+            return str(_STATUS_IDLE)
+        if cmd.startswith("P") and cmd[3] == "R":
+            return parameters.get(cmd[:3], "0")
+        if cmd.startswith("P") and cmd[3] == "S":
+            parameters[cmd[:3]] = "{:g}".format(float(cmd[4:]))
+            return ""
+        if cmd.startswith("A"):
+            parameters["P20"] = "{:g}".format(float(cmd[1:]))
+            parameters["P22"] = parameters["P20"]
+            return ""
+        if cmd in ("S", "SN", "SEC", "L+", "L-", "R+", "R-"):
+            return ""
+        raise ValueError(cmd)
+
+
+def _percentile(values, q):
+    if not values:
+        return float("nan")
+    return values[min(len(values) - 1, int(q / 100 * len(values)))]
+
+
+def _choose(rng, mix, weights):
+    return rng.choices(mix, weights=weights)[0]
+
+
+def _run_op(proxy, op):
+    _, kind, name, arg = op
+    if kind == "read":
+        proxy.read_attribute(name)
+    elif kind == "write":
+        proxy.write_attribute(name, arg)
+    else:
+        proxy.command_inout(name)
+
+
+def _sync_client(trls, mix_name, duration, seed):
+    """Run one blocking client and return (latencies, errors).
+
+    Latencies are recorded for successful requests only.
+    """
+    rng = random.Random(seed)
+    mix = MIXES[mix_name]
+    weights = [op[0] for op in mix]
+    proxies = [tango.DeviceProxy(trl) for trl in trls]
+    latencies = []
+    errors = 0
+    end = time.monotonic() + duration
+    while time.monotonic() < end:
+        proxy = rng.choice(proxies)
+        op = _choose(rng, mix, weights)
+        start = time.perf_counter()
+        try:
+            _run_op(proxy, op)
+        except tango.DevFailed:
+            errors += 1
+        else:
+            # failed requests are counted, but kept out of the latencies
+            latencies.append(time.perf_counter() - start)
+    return latencies, errors
+
+
+def _process_client(trls, mix_name, duration, seed, queue):
+    queue.put(_sync_client(trls, mix_name, duration, seed))
+
+
+async def _async_client(trls, mix_name, duration, seed):
+    rng = random.Random(seed)
+    mix = MIXES[mix_name]
+    weights = [op[0] for op in mix]
+    proxies = [await tango.asyncio.DeviceProxy(trl) for trl in trls]
+    latencies = []
+    errors = 0
+    end = time.monotonic() + duration
+    while time.monotonic() < end:
+        proxy = rng.choice(proxies)
+        _, kind, name, arg = _choose(rng, mix, weights)
+        start = time.perf_counter()
+        try:
+            if kind == "read":
+                await proxy.read_attribute(name)
+            elif kind == "write":
+                await proxy.write_attribute(name, arg)
+            else:
+                await proxy.command_inout(name)
+        except tango.DevFailed:
+            errors += 1
+        else:
+            # failed requests are counted, but kept out of the latencies
+            latencies.append(time.perf_counter() - start)
+    return latencies, errors
+
+
+def run_clients(mode, trls, n_clients, mix_name, duration):
+    """Run a client population and return a list of (latencies, errors)."""
+    if mode == "thread":
+        results = [None] * n_clients
+
+        def target(i):
+            results[i] = _sync_client(trls, mix_name, duration, i)
+
+        threads = [threading.Thread(target=target, args=(i,)) for i in range(n_clients)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        return results
+    elif mode == "process":
+        # spawn: forking after omniORB has started is not supported
+        ctx = multiprocessing.get_context("spawn")
+        queue = ctx.Queue()
+        processes = [
+            ctx.Process(
+                target=_process_client, args=(trls, mix_name, duration, i, queue)
+            )
+            for i in range(n_clients)
+        ]
+        for p in processes:
+            p.start()
+        results = [queue.get() for _ in processes]
+        for p in processes:
+            p.join()
+        return results
+    elif mode == "asyncio":
+
+        async def gather():
+            return await asyncio.gather(
+                *[
+                    _async_client(trls, mix_name, duration, i)
+                    for i in range(n_clients)
+                ]
+            )
+
+        return asyncio.run(gather())
+    raise ValueError(f"Invalid client mode: {mode}")
+
+
+def _free_port(host):
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind((host, 0))
+        return s.getsockname()[1]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=(
+            "Load test PhyMotionAxis devices against a simulated controller."
+        )
+    )
+    parser.add_argument("--axes", type=int, default=20)
+    parser.add_argument("--clients", type=int, default=10)
+    parser.add_argument(
+        "--mode", choices=["thread", "process", "asyncio"], default="thread"
+    )
+    parser.add_argument("--mix", choices=sorted(MIXES), default="mixed")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds")
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        default=0.2,
+        help="TimeOut property of the axes (status query interval)",
+    )
+    args = parser.parse_args()
+
+    host = "127.0.0.1"
+    simulator = SimulatedController((host, 0), args.axes)
+    threading.Thread(target=simulator.serve_forever, daemon=True).start()
+
+    tango_port = _free_port(host)
+    ctrl_name = "sim/phymotion/ctrl"
+    ctrl_trl = f"tango://{host}:{tango_port}/{ctrl_name}#dbase=no"
+    axis_names = [f"sim/phymotion/{axis}" for axis in range(1, args.axes + 1)]
+    devices_info = [
+        {
+            "class": PhyMotionCtrl,
+            "devices": [
+                {
+                    "name": ctrl_name,
+                    "properties": {
+                        "Address": host,
+                        "Port": simulator.server_address[1],
+                        "Modules": list(range(1, args.axes + 1)),
+                    },
+                }
+            ],
+        },
+        {
+            "class": PhyMotionAxis,
+            "devices": [
+                {
+                    "name": name,
+                    "properties": {
+                        "CtrlDevice": ctrl_trl,
+                        "Axis": axis,
+                        "TimeOut": args.timeout,
+                    },
+                }
+                for axis, name in enumerate(axis_names, start=1)
+            ],
+        },
+    ]
+
+    with MultiDeviceTestContext(
+        devices_info, host=host, port=tango_port, process=True
+    ):
+        trls = [f"tango://{host}:{tango_port}/{name}#dbase=no" for name in axis_names]
+        simulator.reset_counters()
+        start = time.monotonic()
+        results = run_clients(args.mode, trls, args.clients, args.mix, args.duration)
+        elapsed = time.monotonic() - start
+    simulator.shutdown()
+
+    latencies = sorted(latency for result in results for latency in result[0])
+    errors = sum(result[1] for result in results)
+    n_requests = len(latencies) + errors
+    print(
+        "{:d} {:s} clients, {:d} axes, mix '{:s}', {:.1f} s".format(
+            args.clients, args.mode, args.axes, args.mix, elapsed
+        )
+    )
+    print("requests:          {:d} ({:d} errors)".format(n_requests, errors))
+    # throughput and latencies of successful requests only
+    print("throughput:        {:.1f} requests/s".format(len(latencies) / elapsed))
+    for q in (50, 95, 99):
+        print(
+            "latency p{:d}:       {:.2f} ms".format(q, 1e3 * _percentile(latencies, q))
+        )
+    if latencies:
+        print("latency max:       {:.2f} ms".format(1e3 * latencies[-1]))
+    if n_requests:
+        print(
+            "hw frames/request: {:.3f}".format(simulator.n_frames / n_requests)
+        )
+        print(
+            "hw cmds/request:   {:.3f}".format(simulator.n_commands / n_requests)
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+#!/usr/bin/python3 -u
+# coding: utf8
+# replay server for frames captured by PhyMotionCtrl (CaptureFile property)
+
+import argparse
+import collections
+import socketserver
+import threading
+import time
+
+
+_ETX = b"\x03"
+_NACK_FRAME = b"\x02\x15\x03"
+
+
+def load_capture(filename):
+    """Load a capture file and return a list of exchanges.
+
+    Each exchange is a tuple (request, reply, latency) where request and
+    reply are the raw frames and latency is the time in seconds between
+    sending the request and receiving the reply in the recorded session.
+    Replies are paired with the oldest outstanding request, so captures of
+    pipelined sessions (several requests before their replies) load in order.
+    """
+    exchanges = []
+    pending = collections.deque()
+    with open(filename) as f:
+        for line in f:
+            line = line.split()
+            if len(line) != 3:
+                continue
+            timestamp, direction = float(line[0]), line[1]
+            frame = bytes.fromhex(line[2])
+            if direction == ">":
+                pending.append((frame, timestamp))
+            elif direction == "<" and pending:
+                request, sent = pending.popleft()
+                exchanges.append((request, frame, timestamp - sent))
+    return exchanges
+
+
+class ReplayHandler(socketserver.BaseRequestHandler):
+    """Serve the recorded replies of one capture to a single connection.
+
+    Requests are matched in recorded order. If a request does not match the
+    next recorded one, the rest of the capture is searched for it and the
+    replay continues from there; unknown requests are answered with NACK.
+    """
+
+    def handle(self):
+        exchanges = self.server.exchanges
+        cursor = 0
+        buffer = b""
+        while True:
+            chunk = self.request.recv(1024)
+            if not chunk:
+                return
+            buffer += chunk
+            while _ETX in buffer:
+                end = buffer.index(_ETX) + 1
+                frame, buffer = buffer[:end], buffer[end:]
+                with self.server.lock:
+                    self.server.n_requests += 1
+                for index in range(cursor, len(exchanges)):
+                    if exchanges[index][0] == frame:
+                        break
+                else:
+                    with self.server.lock:
+                        self.server.n_unmatched += 1
+                    self.request.sendall(_NACK_FRAME)
+                    continue
+                _, reply, latency = exchanges[index]
+                cursor = index + 1
+                if self.server.scale > 0:
+                    time.sleep(latency * self.server.scale)
+                self.request.sendall(reply)
+
+
+class ReplayServer(socketserver.ThreadingTCPServer):
+    """TCP server replaying a capture file with original or scaled latencies.
+
+    :param address: (host, port) tuple to listen on
+    :param exchanges: list of exchanges as returned by load_capture()
+    :param scale: factor applied to the recorded reply latencies,
+        1 replays the original timing, 0 replies as fast as possible
+    """
+
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, address, exchanges, scale=1.0):
+        super().__init__(address, ReplayHandler)
+        self.exchanges = exchanges
+        self.scale = scale
+        self.n_requests = 0
+        self.n_unmatched = 0
+        # guards the counters shared by all handler threads
+        self.lock = threading.Lock()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Serve a PhyMotionCtrl capture file over TCP."
+    )
+    parser.add_argument("capture", help="capture file written by PhyMotionCtrl")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=22222)
+    parser.add_argument(
+        "--scale",
+        type=float,
+        default=1.0,
+        help="latency scaling factor (default: 1.0, 0 disables delays)",
+    )
+    args = parser.parse_args()
+
+    exchanges = load_capture(args.capture)
+    print("Loaded {:d} exchanges from {:s}".format(len(exchanges), args.capture))
+    with ReplayServer((args.host, args.port), exchanges, args.scale) as server:
+        print("Replaying on {:s}:{:d}".format(args.host, args.port))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+    print(
+        "Served {:d} requests, {:d} unmatched".format(
+            server.n_requests, server.n_unmatched
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
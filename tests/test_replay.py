@@ -0,0 +1,28 @@
+import pytest
+
+pytest.importorskip("tango")
+
+from tangods_phymotion.replay import load_capture  # noqa: E402
+
+
+def _frame(payload):
+    return b"\x02" + payload + b"\x03"
+
+
+def test_load_capture_pipelined(tmp_path):
+    se, p20 = _frame(b"01.1SE:XX"), _frame(b"01.1P20R:XX")
+    reply_se, reply_p20 = _frame(b"\x0610"), _frame(b"\x0650")
+    capture = tmp_path / "capture.log"
+    capture.write_text(
+        "1.000 > {:s}\n"
+        "1.010 > {:s}\n"
+        "1.050 < {:s}\n"
+        "1.070 < {:s}\n".format(se.hex(), p20.hex(), reply_se.hex(), reply_p20.hex())
+    )
+    exchanges = load_capture(capture)
+    assert [(req, rep) for req, rep, _ in exchanges] == [
+        (se, reply_se),
+        (p20, reply_p20),
+    ]
+    assert exchanges[0][2] == pytest.approx(0.05)
+    assert exchanges[1][2] == pytest.approx(0.06)